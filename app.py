@@ -3,10 +3,11 @@
 # ==============================================================================
 import streamlit as st          # 导入 Streamlit，这是构建 Web 应用的核心库
 import pandas as pd             # 导入 Pandas，用于数据读取、清洗和处理
+import numpy as np              # 导入 NumPy，用于向量化数值计算
 import plotly.express as px     # 导入 Plotly Express，用于绘制简单、快捷的交互式图表
-import plotly.graph_objects as go # 引入 graph_objects 用于画雷达图
+import plotly.graph_objects as go # 引入 graph_objects，用于直接构建图表对象
+from plotly.subplots import make_subplots # 引入子图工具，用于把多张小图合并成一张
 from sklearn.cluster import KMeans              # 从 Scikit-learn 导入 K-Means 聚类算法
-from sklearn.preprocessing import StandardScaler # 导入标准化工具，用于机器学习前的数据预处理
 
 # ==============================================================================
 # 1. 页面基础配置
@@ -21,19 +22,30 @@ st.set_page_config(
 # ==============================================================================
 # 2. 数据加载函数 (带缓存机制)
 # ==============================================================================
-# 使用装饰器缓存数据，避免每次用户交互（如点击按钮）时都重新读取 CSV，提高运行速度
-@st.cache_data
+# 定义元数据列名（不需要参与绘图的列）
+metadata_cols = ['date', 'hour', 'type', 'datetime_obj']
+
+# 读取 CSV 并构造时间列，由下面的 load_all 调用
 def load_data():
     try:
+        csv_path = 'china_cities_20251206_cleaned.csv'
+
+        # 先只读表头，提前为每一列指定数据类型，省去 read_csv 的类型推断：
+        # 日期/小时用小整数，污染物类型用分类 (category)，城市数值用 float32
+        # 可能存在的错误列 'datetime' 直接跳过不读，后续处理都不必再排除它
+        header = [c for c in pd.read_csv(csv_path, nrows=0).columns if c != 'datetime']
+        dtype_map = {c: 'float32' for c in header if c not in ('date', 'hour', 'type')}
+        dtype_map.update({'date': 'int32', 'hour': 'int8', 'type': 'category'})
+
         # 读取清洗后的 CSV 数据文件
-        df = pd.read_csv('china_cities_20251206_cleaned.csv')
+        df = pd.read_csv(csv_path, usecols=header, dtype=dtype_map)
         
         # 构造一个标准的时间对象列 (datetime_obj)
-        # 逻辑：将 date(20251206) 和 hour(0-23) 拼接成字符串，再转为 datetime 格式
-        # .str.zfill(2) 的作用是把 '1' 变成 '01'，确保格式统一
-        df['datetime_obj'] = pd.to_datetime(
-            df['date'].astype(str) + df['hour'].astype(str).str.zfill(2), 
-            format='%Y%m%d%H'
+        # 逻辑：date(20251206) 按日期解析，再加上 hour(0-23) 个小时，
+        # 全程是数值运算，不需要把两列拼接成字符串再逐个解析
+        df['datetime_obj'] = (
+            pd.to_datetime(df['date'], format='%Y%m%d')
+            + pd.to_timedelta(df['hour'], unit='h')
         )
         return df # 返回处理好的 DataFrame
     except Exception as e:
@@ -41,8 +53,42 @@ def load_data():
         st.error(f"数据加载失败: {e}")
         return pd.DataFrame() # 返回空表防止程序崩溃
 
+# 【数据管线：加载 + 透视表】
+# 读取、城市列识别、透视表重塑放在同一个缓存函数中，整个会话只执行一次，
+# 避免每次用户交互（如点击按钮）导致脚本重跑时重复读取 CSV 和整表重塑
+# 返回 (原始宽表, 透视表, 城市列名列表)
+@st.cache_data
+def load_all():
+    df = load_data()
+    if df.empty:
+        return df, df, []
+
+    # 获取所有城市的列名（排除元数据列；错误列 'datetime' 在加载时已跳过）
+    city_cols = [c for c in df.columns if c not in metadata_cols]
+
+    # 同一 (时间, 类型) 正常只有一行；若 CSV 中有重复行，保留最后一条，
+    # 保证下面的重塑是纯粹的一一对应，无需 pivot_table 那样的分组聚合
+    df = df.drop_duplicates(['datetime_obj', 'type'], keep='last')
+
+    # 【转换 1：透视表格式】 (Pivot Table)
+    # 适用于：相关性分析、散点图、机器学习。每一行是一个(时间,城市)对，列是各种污染物
+    # 原表本身就是"行=时间x污染物，列=城市"的宽表，直接把城市列压成一层索引 (stack)，
+    # 再把污染物类型展开成列 (unstack)，一步得到透视表，不再经过 melt + pivot_table 的往返
+    df_pivot = (
+        df.set_index(['datetime_obj', 'type'])[city_cols] # 行索引：(时间, 类型)
+        .rename_axis(columns='City')                     # 城市列名这一层命名为 City
+        .stack(future_stack=True)                        # 城市：列 -> 行索引
+        .unstack('type')                                 # 类型：行索引 -> 列
+        .dropna(how='all')                               # 与 pivot_table 一致，丢弃全空的行
+        .reset_index()                                   # 重置索引，变回普通 DataFrame
+    )
+    # 城市名转为分类 (category)：字符串只在这里哈希一次，之后按城市分组只比较整数编码
+    # （污染物类型在读取 CSV 时已经是分类类型）
+    df_pivot['City'] = df_pivot['City'].astype('category')
+    return df, df_pivot, city_cols
+
 # 调用函数加载数据
-df = load_data()
+df, df_pivot, city_cols = load_all()
 
 # 如果数据为空（加载失败），停止后续代码执行
 if df.empty:
@@ -51,28 +97,56 @@ if df.empty:
 # ==============================================================================
 # 3. 数据预处理 (为绘图做准备)
 # ==============================================================================
-# 定义元数据列名（不需要参与绘图的列）
-metadata_cols = ['date', 'hour', 'type', 'datetime_obj']
-
-# 获取所有城市的列名（排除元数据列，并排除可能存在的错误列名）
-city_cols = [c for c in df.columns if c not in metadata_cols and c != 'datetime'] 
-
-# 【转换 1：长表格式】 (Long Format)
-# 适用于：折线图、柱状图。将"城市"从列名变成一列数据
-df_long = df.melt(
-    id_vars=metadata_cols,  # 保持不变的列（时间、类型）
-    value_vars=city_cols,   # 需要“融化”的列（所有城市）
-    var_name='City',        # 新的列名：城市名
-    value_name='Value'      # 新的列名：数值
-)
+# 以下派生表的输入在整个会话中不会变化，放进缓存函数后只计算一次。
+# 参数名前加下划线 (_df)，让 Streamlit 跳过对大表的哈希计算
 
-# 【转换 2：透视表格式】 (Pivot Table)
-# 适用于：相关性分析、散点图、机器学习。每一行是一个(时间,城市)对，列是各种污染物
-df_pivot = df_long.pivot_table(
-    index=['datetime_obj', 'City'], # 索引
-    columns='type',                 # 列：变成 AQI, PM2.5, PM10 等
-    values='Value'                  # 值
-).reset_index()                     # 重置索引，变回普通 DataFrame
+# 【转换 2：按污染物类型切分的宽表】
+# 适用于：折线图。{类型: 以时间为索引、城市为列的子表}，
+# Tab 2 只需取出一种指标、几个选中城市再展开，不必维护全量长表
+@st.cache_data
+def build_by_type(_df):
+    return {
+        t: g.set_index('datetime_obj')[city_cols]
+        for t, g in _df.groupby('type', sort=False, observed=True)
+    }
+
+# 【汇总：各污染物的城市均值】
+# 行 = 污染物类型，列 = 城市。直接在宽表上按类型分组一次算出所有指标的均值，
+# Tab 1 切换指标或排名模式时只需取其中一行
+# 用类型的整数编码按行累加求和、计数，直接得到连续的 NumPy 矩阵，跳过 pandas groupby 的分组开销
+@st.cache_data
+def build_type_means(_df):
+    codes, types = pd.factorize(_df['type'], sort=True)
+    keep = codes >= 0                                   # 类型缺失的行编码为 -1，不参与统计
+    codes = codes[keep]
+    vals = _df.loc[keep, city_cols].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(vals)                             # 与 mean() 一致，忽略缺失值
+
+    sums = np.zeros((len(types), len(city_cols)))
+    counts = np.zeros((len(types), len(city_cols)))
+    np.add.at(sums, codes, np.where(valid, vals, 0))
+    np.add.at(counts, codes, valid)
+    means = np.divide(sums, counts, out=np.full_like(sums, np.nan), where=counts > 0)
+    means = means.astype(np.float32) # 累加用 float64 保证精度，结果与原始数据一样存为 float32
+
+    # 类型名转为普通字符串索引，转置后可作为普通列名
+    return pd.DataFrame(means, index=pd.Index(np.asarray(types).astype(str), name='type'), columns=city_cols)
+
+by_type = build_by_type(df)
+type_means = build_type_means(df)
+
+# 转置得到 行 = 城市，列 = 污染物类型 的城市均值表，
+# 与透视表按城市分组求均值的结果相同，Tab 4 散点图和 Tab 6 聚类直接使用，无需再对透视表分组
+city_means = type_means.T.rename_axis(index='City', columns='type')
+
+# 【列名匹配】目标指标名 -> 数据中实际的列名（不区分大小写、忽略首尾空格）
+# 与控件无关，缓存后只解析一次；先建一次 {规范化列名: 列名} 的字典，再逐个目标查表
+@st.cache_data
+def resolve_features(columns, targets):
+    norm = {}
+    for c in columns:
+        norm.setdefault(c.lower().strip(), c) # 同名时保留第一个出现的列
+    return {t: norm[t.lower()] for t in targets if t.lower() in norm}
 
 # ==============================================================================
 # 4. 侧边栏：AI 智能顾问模块
@@ -82,8 +156,15 @@ st.sidebar.title("🤖 AI 智能顾问") # 侧边栏大标题
 # 让用户选择所在的城市
 user_city = st.sidebar.selectbox("📍 请选择您所在的城市:", city_cols, index=0)
 
-# 获取该用户所选城市的最新一条数据（按时间排序取最后一行）
-latest_df = df_pivot[df_pivot['City'] == user_city].sort_values('datetime_obj').iloc[-1]
+# 预先取出每个城市的最新一条数据（每城时间最大的一行），整个会话只算一次，
+# 之后切换城市只需按城市名查表；用 idxmax 线性扫描定位，不必对整表排序
+@st.cache_data
+def latest_per_city(_df_pivot):
+    latest_idx = _df_pivot.groupby('City', sort=False, observed=True)['datetime_obj'].idxmax()
+    return _df_pivot.loc[latest_idx].set_index('City')
+
+# 获取该用户所选城市的最新一条数据
+latest_df = latest_per_city(df_pivot).loc[user_city]
 
 # 提取关键指标，如果取不到则默认为 0
 cur_aqi = latest_df.get('AQI', 0)
@@ -94,15 +175,22 @@ cur_pm25 = latest_df.get('PM2.5', 0)
 st.sidebar.markdown(f"**当前 AQI指数**: `{int(cur_aqi)}`")
 
 # --- 规则引擎：根据 AQI 生成建议 ---
-adv_color = "green"  # 默认颜色：绿色
-adv_text = "空气很好，适合户外活动！🏃" # 默认文案
+# AQI 分段阈值，以及每一段对应的文案和颜色（第 i 段 = 超过第 i 个阈值）
+AQI_BINS = [50, 100, 150, 200, 300]
+ADV_TEXTS = (
+    "空气很好，适合户外活动！🏃",     # AQI <= 50
+    "空气尚可，敏感人群注意。",       # AQI > 50
+    "轻度污染，建议佩戴口罩。😷",     # AQI > 100
+    "中度污染，减少户外停留。🏠",     # AQI > 150
+    "重度污染，严禁户外运动！🚫",     # AQI > 200
+    "严重污染，开启空气净化器！🌪️",   # AQI > 300
+)
+ADV_COLORS = ("green", "orange", "orange", "red", "red", "red")
+AQI_LEVELS = ('优', '良', '轻度', '中度', '重度', '严重') # 各段对应的空气质量等级（Tab 5 使用）
 
-# 根据 AQI 范围修改文案和颜色
-if cur_aqi > 50: adv_text = "空气尚可，敏感人群注意。"; adv_color="orange"
-if cur_aqi > 100: adv_text = "轻度污染，建议佩戴口罩。😷"; adv_color="orange"
-if cur_aqi > 150: adv_text = "中度污染，减少户外停留。🏠"; adv_color="red"
-if cur_aqi > 200: adv_text = "重度污染，严禁户外运动！🚫"; adv_color="red"
-if cur_aqi > 300: adv_text = "严重污染，开启空气净化器！🌪️"; adv_color="red"
+# 用二分查找定位 AQI 所在的区间，直接取出对应的文案和颜色
+adv_idx = np.searchsorted(AQI_BINS, cur_aqi)
+adv_text, adv_color = ADV_TEXTS[adv_idx], ADV_COLORS[adv_idx]
 
 # --- 特殊规则：沙尘天气判断 ---
 # 逻辑：如果 PM10 大于 150 且 PM10 是 PM2.5 的两倍以上，认为是沙尘
@@ -123,8 +211,8 @@ st.sidebar.markdown("---")
 st.sidebar.header("🎛️ 数据筛选")
 # 多选框：选择要对比的城市，默认选中北上广西
 selected_cities = st.sidebar.multiselect("对比分析城市:", city_cols, default=["北京", "上海", "西安", "广州"])
-# 下拉框：选择要分析的主要指标（如 AQI, PM2.5）
-pollutant_type = st.sidebar.selectbox("主要分析指标:", df['type'].unique(), index=0)
+# 下拉框：选择要分析的主要指标（如 AQI, PM2.5），选项直接取自按类型切分好的索引
+pollutant_type = st.sidebar.selectbox("主要分析指标:", list(by_type), index=0)
 
 # ==============================================================================
 # 6. 主界面：标题与 Tabs 布局
@@ -143,32 +231,43 @@ tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
 with tab1:
     st.subheader(f"🏙️ 空间维度：{pollutant_type} 城市排名")
     
+    # 各 Tab 的图表都按其真正依赖的输入缓存（这里是指标和排名模式），
+    # 其它控件（如侧边栏城市）变化导致重跑时直接复用已构建好的图
+    @st.cache_data
+    def build_rank_fig(pollutant_type, rank_mode):
+        df_rank = type_means.loc[pollutant_type].dropna().sort_values(ascending=False)
+        plot_data = df_rank.head(15) if rank_mode == "Top 15 污染" else df_rank.tail(15).sort_values()
+        
+        fig1 = px.bar(
+            x=plot_data.index, 
+            y=plot_data.values, 
+            color=plot_data.values, 
+            color_continuous_scale='RdYlGn_r' if rank_mode=="Top 15 清洁" else 'Reds',
+            labels={'x': '城市名称', 'y': f'{pollutant_type} 平均数值'},
+            text_auto='.1f'
+        )
+        fig1.update_layout(xaxis_tickangle=0)
+        return fig1
+
     # 删除了分栏 (st.columns)，直接展示
-    df_rank = df_long[df_long['type'] == pollutant_type].groupby('City')['Value'].mean().sort_values(ascending=False)
     rank_mode = st.radio("查看模式", ["Top 15 污染", "Top 15 清洁"], horizontal=True)
-    
-    plot_data = df_rank.head(15) if rank_mode == "Top 15 污染" else df_rank.tail(15).sort_values()
-    
-    fig1 = px.bar(
-        x=plot_data.index, 
-        y=plot_data.values, 
-        color=plot_data.values, 
-        color_continuous_scale='RdYlGn_r' if rank_mode=="Top 15 清洁" else 'Reds',
-        labels={'x': '城市名称', 'y': f'{pollutant_type} 平均数值'},
-        text_auto='.1f'
-    )
-    fig1.update_layout(xaxis_tickangle=0)
-    st.plotly_chart(fig1, use_container_width=True)
+    st.plotly_chart(build_rank_fig(pollutant_type, rank_mode), use_container_width=True)
 
 # ==============================================================================
 # Tab 2: 时间维度 (折线图趋势)
 # ==============================================================================
 with tab2:
     st.subheader(f"🕰️ 时间维度：{pollutant_type} 24H 变化")
-    # 检查是否选择了城市，如果没选则提示警告
-    if selected_cities:
+    # 图表按 (指标, 选中城市) 缓存
+    @st.cache_data
+    def build_trend_fig(pollutant_type, cities):
         # 筛选数据：只保留选中的指标和选中的城市
-        df_trend = df_long[(df_long['type'] == pollutant_type) & (df_long['City'].isin(selected_cities))].sort_values('datetime_obj')
+        df_trend = (
+            by_type[pollutant_type][list(cities)]                             # 只取当前指标、选中城市
+            .reset_index()
+            .melt(id_vars='datetime_obj', var_name='City', value_name='Value') # 只展开这一小块
+            .sort_values('datetime_obj')
+        )
         
         # 绘制折线图
         fig2 = px.line(
@@ -176,7 +275,7 @@ with tab2:
             x='datetime_obj', 
             y='Value', 
             color='City',   # 不同城市不同颜色
-            markers=True,   # 显示数据点标记
+            render_mode='webgl', # 使用 WebGL 渲染，避免每个点都生成 SVG 节点
             # 设置中文标签映射
             labels={
                 'datetime_obj': '监测时间 (2025-12-06)', 
@@ -187,7 +286,11 @@ with tab2:
         
         # 强制 X 轴水平显示
         fig2.update_layout(xaxis_tickangle=0) 
-        st.plotly_chart(fig2, use_container_width=True)
+        return fig2
+
+    # 检查是否选择了城市，如果没选则提示警告
+    if selected_cities:
+        st.plotly_chart(build_trend_fig(pollutant_type, tuple(selected_cities)), use_container_width=True)
     else: 
         st.warning("请在侧边栏选择城市")
 
@@ -196,13 +299,31 @@ with tab2:
 # ==============================================================================
 with tab3:
     st.subheader("🔗 关联维度：污染物相关性矩阵")
+    # 相关系数矩阵及其热力图都与用户交互无关，缓存整张图，整个会话只构建一次
+    # 数据量很大时随机抽样不超过 CORR_MAX_ROWS 行计算相关系数，结果足够稳定且开销有上限
+    CORR_MAX_ROWS = 50_000
+
+    @st.cache_data
+    def corr_fig(_df_pivot, cols):
+        sample = _df_pivot[list(cols)]
+        if len(sample) > CORR_MAX_ROWS:
+            sample = sample.sample(n=CORR_MAX_ROWS, random_state=0)
+        corr = sample.corr().to_numpy()
+        fig = go.Figure(go.Heatmap(
+            z=corr, x=list(cols), y=list(cols),
+            text=np.round(corr, 2), texttemplate='%{text:.2f}', # 预先算好的数值标注
+            colorscale='RdBu_r', zmin=-1, zmax=1
+        ))
+        fig.update_yaxes(autorange='reversed') # 与 imshow 一致：第一行在最上方
+        return fig
+
     # 定义所有可能的污染物列名
     valid_cols = [p for p in ['AQI', 'PM2.5', 'PM10', 'CO', 'NO2', 'SO2', 'O3'] if p in df_pivot.columns]
     
     # 如果数据中有超过1种污染物，才能画相关性图
     if len(valid_cols) > 1:
-        # 计算相关系数矩阵 (.corr())，并绘制热力图 (imshow)
-        fig3 = px.imshow(df_pivot[valid_cols].corr(), text_auto=".2f", color_continuous_scale="RdBu_r")
+        # 计算相关系数矩阵 (.corr())，并绘制热力图 (Heatmap)
+        fig3 = corr_fig(df_pivot, tuple(valid_cols))
         st.plotly_chart(fig3, use_container_width=True)
 
 # ==============================================================================
@@ -210,22 +331,31 @@ with tab3:
 # ==============================================================================
 with tab4:
     st.subheader("🔬 结构维度：PM2.5/PM10 成分分析")
-    # 检查是否有这两列数据
-    if 'PM2.5' in df_pivot.columns and 'PM10' in df_pivot.columns:
-        # 绘制散点图
+    # 散点图只依赖城市均值表，与任何控件无关，整个会话只构建一次
+    @st.cache_data
+    def build_scatter_fig():
+        # 使用每个城市的 24 小时均值，每个城市只画一个点，点数从 (时间x城市) 降到城市数
+        df_scatter = city_means[['PM10', 'PM2.5', 'AQI']].reset_index()
+
+        # 绘制散点图（WebGL 渲染）
         fig4 = px.scatter(
-            df_pivot, 
+            df_scatter, 
             x='PM10', 
             y='PM2.5', 
             color='AQI',         # 点的颜色代表 AQI 高低
             hover_name='City',   # 鼠标悬停显示城市名
-            title="颗粒物结构分布", 
+            title="颗粒物结构分布 (城市 24H 均值)", 
             opacity=0.6,
+            render_mode='webgl', # 使用 GPU 加速的 WebGL 画布
             labels={'PM10': 'PM10 浓度 (μg/m³)', 'PM2.5': 'PM2.5 浓度 (μg/m³)'} # 中文轴标签
         )
         # 添加一条对角虚线 (x=y)，用于辅助判断
         fig4.add_shape(type="line", x0=0, y0=0, x1=500, y1=500, line=dict(color="Gray", dash="dash"))
-        st.plotly_chart(fig4, use_container_width=True)
+        return fig4
+
+    # 检查是否有这两列数据
+    if 'PM2.5' in city_means.columns and 'PM10' in city_means.columns:
+        st.plotly_chart(build_scatter_fig(), use_container_width=True)
 
 # ==============================================================================
 # Tab 5: 分布维度 (饼图)
@@ -233,22 +363,28 @@ with tab4:
 with tab5:
     st.subheader("📊 分布维度：空气质量等级占比")
     
-    # 辅助函数：根据 AQI 数值返回等级名称
-    def get_level(aqi):
-        if aqi <= 50: return '优'
-        elif aqi <= 100: return '良'
-        elif aqi <= 150: return '轻度'
-        elif aqi <= 200: return '中度'
-        elif aqi <= 300: return '重度'
-        else: return '严重'
-
-    if 'AQI' in df_pivot.columns:
+    # 饼图同样与控件无关，只构建一次
+    @st.cache_data
+    def build_level_fig():
+        # 所有 (时间, 城市) 的 AQI 数值，直接取自宽表的 AQI 子表，并去掉缺失值
+        aqi_values = by_type['AQI'].to_numpy().ravel()
+        aqi_values = aqi_values[~np.isnan(aqi_values)]
+
         # 计算每个等级出现的次数
-        counts = df_pivot['AQI'].dropna().apply(get_level).value_counts().reset_index()
-        counts.columns = ['Level', 'Count'] # 重命名列
+        # 与侧边栏建议共用 AQI_BINS：searchsorted 一次性得到每个数值所在的分段
+        # (<=50 为优、<=100 为良……)，再用 bincount 计数，全程不逐行调用 Python 函数
+        level_idx = np.searchsorted(AQI_BINS, aqi_values)
+        counts = pd.DataFrame({
+            'Level': AQI_LEVELS,
+            'Count': np.bincount(level_idx, minlength=len(AQI_LEVELS)),
+        })
+        counts = counts[counts['Count'] > 0].sort_values('Count', ascending=False) # 去掉没有出现过的等级
         
         # 绘制饼图
-        st.plotly_chart(px.pie(counts, values='Count', names='Level', color_discrete_sequence=px.colors.sequential.RdBu_r), use_container_width=True)
+        return px.pie(counts, values='Count', names='Level', color_discrete_sequence=px.colors.sequential.RdBu_r)
+
+    if 'AQI' in by_type:
+        st.plotly_chart(build_level_fig(), use_container_width=True)
 
 # ==============================================================================
 # Tab 6: 机器学习聚类 K-Means
@@ -268,23 +404,50 @@ with tab6:
     # --- 1. 智能列名匹配 (已移除 CO) ---
     # 【修改点】列表中删除了 'CO'
     target_features = ['AQI', 'PM2.5', 'PM10', 'NO2', 'SO2'] 
-    ml_features = []
-    for t in target_features:
-        for c in df_pivot.columns:
-            if t.lower() == c.lower().strip(): 
-                ml_features.append(c)
-                break
+    # name_map: 目标指标名 -> 数据中实际的列名，后续打标直接按列名取值
+    name_map = resolve_features(tuple(city_means.columns), tuple(target_features))
+    ml_features = list(name_map.values())
 
     if len(ml_features) < 3:
         st.error(f"❌ 关键指标缺失！请检查 CSV 列名。当前找到: {ml_features}")
         st.stop()
 
     # --- 2. 数据准备 ---
-    df_city_features = df_pivot.groupby('City')[ml_features].mean()
-
-    # 【严谨清洗】直接剔除包含缺失值的城市
-    count_before = len(df_city_features)
-    df_city_features = df_city_features.dropna()
+    # 城市特征均值、标准化、模型训练都拆成带缓存的函数：拖动 K 滑块时只有训练一步会变，
+    # 其余步骤直接命中缓存
+
+    # 每个城市的各项指标均值，并【严谨清洗】直接剔除包含缺失值的城市
+    # 返回 (清洗前城市数, 清洗后的特征表)
+    @st.cache_data
+    def city_features(_city_means, features):
+        df_means = _city_means[list(features)].sort_index() # 按城市名排序，聚类初始化结果不受 CSV 列顺序影响
+        return len(df_means), df_means.dropna()
+
+    # 标准化 (z-score)：与 StandardScaler 相同（总体标准差，方差为 0 的列不缩放），
+    # 直接用 NumPy 一次算完，省去构造 sklearn 对象和参数校验的开销
+    # 先复制出一份独立的 float32 矩阵，之后原地减均值、除标准差，不再分配中间矩阵
+    @st.cache_data
+    def scaled(data_key, _features_df):
+        X = np.array(_features_df, dtype=np.float32) # 独立副本，原地修改不会影响特征表
+        X -= X.mean(axis=0)
+        sd = X.std(axis=0)
+        sd[sd == 0] = 1
+        X /= sd
+        return X
+
+    # 训练好的模型按 (数据哈希, K) 缓存，只有数据或 K 真正变化时才重新训练
+    # 城市级数据只有几百行 x 5 列：k-means++ 固定种子初始化一次就足够稳定，
+    # 不必重复 10 次；Elkan 算法利用三角不等式跳过中心几乎不动时的距离计算
+    # scaled() 每次返回的都是缓存数据的独立副本，因此允许 KMeans 原地中心化 (copy_x=False)，
+    # 省去内部再复制一份矩阵
+    @st.cache_resource
+    def fit_kmeans(data_key, _data_scaled, k):
+        return KMeans(
+            n_clusters=k, random_state=42, n_init=1, init='k-means++', algorithm='elkan',
+            copy_x=False
+        ).fit(_data_scaled)
+
+    count_before, df_city_features = city_features(city_means, tuple(ml_features))
     count_after = len(df_city_features)
 
     st.caption(f"📉 数据清洗：原始 {count_before} -> 有效 **{count_after}** 个城市")
@@ -293,44 +456,66 @@ with tab6:
         st.error("❌ 所有城市均存在数据缺失，无法绘图。")
     else:
         # --- 3. 训练模型 ---
-        scaler = StandardScaler()
-        data_scaled = scaler.fit_transform(df_city_features)
-        
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-        df_city_features['Cluster_ID'] = kmeans.fit_predict(data_scaled)
+        # 特征表的稳定哈希作为缓存键，Streamlit 不必在每次重跑时再去哈希整张表
+        data_key = pd.util.hash_pandas_object(df_city_features).values.tobytes()
+
+        # 聚类结果另存一份在 session_state 中，依赖 (K, 特征数据)：
+        # 依赖不变时（如只切换了侧边栏指标）直接复用上次的标签
+        km_key = (n_clusters, data_key)
+        if st.session_state.get('km_key') != km_key:
+            data_scaled = scaled(data_key, df_city_features)
+            kmeans = fit_kmeans(data_key, data_scaled, n_clusters)
+            st.session_state['km_labels'] = kmeans.labels_
+            st.session_state['km_key'] = km_key
+
+        df_city_features['Cluster_ID'] = st.session_state['km_labels']
         
-        # 计算中心点
-        cluster_means = df_city_features.groupby('Cluster_ID')[ml_features].mean()
+        # 计算中心点（簇编号无需排序，sort=False 省去对分组键的排序）
+        cluster_means = df_city_features.groupby('Cluster_ID', sort=False)[ml_features].mean()
         
         # --- 4. 详细分类打标 (已移除 CO 相关逻辑) ---
-        def get_cluster_detail(row):
-            def get_val(name):
-                for k in row.index:
-                    if name.lower() in k.lower(): return row[k]
-                return 0
-            
-            aqi = get_val('AQI')
-            pm10 = get_val('PM10')
-            pm25 = get_val('PM2.5')
-            so2 = get_val('SO2')
-            no2 = get_val('NO2')
-            # co = get_val('CO') # 【修改点】不再获取 CO
-            
-            ratio_pm = pm10 / (pm25 + 0.1)
-            
-            if aqi < 40: return "🍃 极优生态"
-            if aqi < 70 and so2 < 10: return "🌿 清洁宜居"
-            if pm10 > 200 and ratio_pm > 2.0: return "🏜️ 强沙尘"
-            if pm10 > 120 and ratio_pm > 1.5: return "🌪️ 浮尘扬沙"
-            if so2 > 25: return "🏭 工业燃煤" 
+        # 对整张 cluster_means 按列取值，一次性为所有簇打标，不再逐行 iterrows
+        def get_col(name):
+            # 通过 name_map 直接定位列，缺失的指标视为 0
+            if name in name_map: return cluster_means[name_map[name]].to_numpy()
+            return np.zeros(len(cluster_means))
+
+        aqi = get_col('AQI')
+        pm10 = get_col('PM10')
+        pm25 = get_col('PM2.5')
+        so2 = get_col('SO2')
+        no2 = get_col('NO2')
+        # co = get_col('CO') # 【修改点】不再获取 CO
+
+        ratio_pm = pm10 / (pm25 + 0.1)
+
+        # 条件按优先级排列，np.select 取第一个满足的条件，与逐条 if 返回的语义一致
+        conds = [
+            aqi < 40,
+            (aqi < 70) & (so2 < 10),
+            (pm10 > 200) & (ratio_pm > 2.0),
+            (pm10 > 120) & (ratio_pm > 1.5),
+            so2 > 25,
             # 【修改点】原逻辑需要 CO > 1.2，现在改为只看 SO2，或者归入工业过渡型
-            if so2 > 15: return "🏗️ 燃煤过渡" 
-            if no2 > 45: return "🚗 交通拥堵" 
-            if aqi > 150: return "🔴 极重复合"
-            if aqi > 100: return "🟠 轻度雾霾"
-            return "🔵 综合过渡"
-
-        label_map = {i: get_cluster_detail(row) for i, row in cluster_means.iterrows()}
+            so2 > 15,
+            no2 > 45,
+            aqi > 150,
+            aqi > 100,
+        ]
+        names = [
+            "🍃 极优生态",
+            "🌿 清洁宜居",
+            "🏜️ 强沙尘",
+            "🌪️ 浮尘扬沙",
+            "🏭 工业燃煤",
+            "🏗️ 燃煤过渡",
+            "🚗 交通拥堵",
+            "🔴 极重复合",
+            "🟠 轻度雾霾",
+        ]
+        labels = np.select(conds, names, default="🔵 综合过渡")
+
+        label_map = dict(zip(cluster_means.index, labels.tolist()))
         df_city_features['Label'] = df_city_features['Cluster_ID'].map(label_map)
 
         # --- 5. 可视化：3D 总览图 ---
@@ -354,67 +539,62 @@ with tab6:
         st.markdown("### 📊 污染特征详细拆解")
         st.markdown("下图展示了每一类城市的具体污染物浓度均值")
         
-        cols = st.columns(4)
-        
-        for i, (cluster_id, label) in enumerate(label_map.items()):
-            col_idx = i % 4 
-            if i >= 4 and col_idx == 0: cols = st.columns(4)
-            
-            with cols[col_idx]:
-                # --- 标题区 ---
-                st.markdown(f"**{label}**")
-                
-                cities = df_city_features[df_city_features['Cluster_ID'] == cluster_id].index.tolist()
-                priority = ['北京', '上海', '西安', '喀什地区', '三亚', '唐山', '武汉', '郑州']
-                shown_cities = [c for c in cities if c in priority] + [c for c in cities if c not in priority]
-                st.caption(f"📍 {', '.join(shown_cities[:2])} 等{len(cities)}城")
-                
-                # --- 数据分析区 ---
-                real_vals = cluster_means.loc[cluster_id]
-                max_feat = real_vals.idxmax()
-                max_val = real_vals.max()
-                
-                colors = []
-                for feat in real_vals.index:
-                    if 'PM' in feat: colors.append('#FFA15A') 
-                    elif 'SO' in feat: colors.append('#EF553B') 
-                    elif 'NO' in feat: colors.append('#AB63FA') 
-                    elif 'AQI' in feat: colors.append('#19D3F3') 
-                    else: colors.append('#636EFA')
-                
-                # --- 柱状图绘制 ---
-                fig_bar = px.bar(
-                    x=real_vals.index, 
-                    y=real_vals.values,
-                    text_auto='.0f', 
-                )
-                
-                fig_bar.update_traces(
-                    marker_color=colors,
+        # 所有簇画在同一张图里 (每簇一个子图，每行 4 个)，
+        # 只构建并传输一次图表，而不是每个簇各调用一次 st.plotly_chart
+
+        # --- 标题区：每个子图的标题 = 类别名 + 代表城市 + 主导特征 ---
+        priority = ['北京', '上海', '西安', '喀什地区', '三亚', '唐山', '武汉', '郑州']
+        titles = {}
+        for cluster_id, label in label_map.items():
+            cities = df_city_features[df_city_features['Cluster_ID'] == cluster_id].index.tolist()
+            shown_cities = [c for c in cities if c in priority] + [c for c in cities if c not in priority]
+            max_feat = cluster_means.loc[cluster_id].idxmax()
+            titles[cluster_id] = f"<b>{label}</b><br>📍 {', '.join(shown_cities[:2])} 等{len(cities)}城 · 特征:{max_feat}"
+
+        colors = {}
+        for feat in ml_features:
+            if 'PM' in feat: colors[feat] = '#FFA15A'
+            elif 'SO' in feat: colors[feat] = '#EF553B'
+            elif 'NO' in feat: colors[feat] = '#AB63FA'
+            elif 'AQI' in feat: colors[feat] = '#19D3F3'
+            else: colors[feat] = '#636EFA'
+
+        # --- 柱状图绘制 ---
+        # 直接用 graph_objects 逐簇添加 go.Bar，跳过 px 对 DataFrame 的推断和标签映射
+        bar_colors = [colors[f] for f in ml_features]
+        n_rows = (len(label_map) + 3) // 4
+        fig_bar = make_subplots(
+            rows=n_rows, cols=4,
+            subplot_titles=[titles[c] for c in label_map],
+            horizontal_spacing=0.03,
+            vertical_spacing=0.25 / n_rows,
+        )
+
+        for i, cluster_id in enumerate(label_map):
+            real_vals = cluster_means.loc[cluster_id, ml_features].to_numpy()
+            row, col = i // 4 + 1, i % 4 + 1
+            fig_bar.add_trace(
+                go.Bar(
+                    x=ml_features,
+                    y=real_vals,
+                    marker_color=bar_colors,
+                    text=[f'{v:.0f}' for v in real_vals],
                     textfont_size=10, 
                     textposition='outside', 
                     cliponaxis=False 
-                )
-                
-                fig_bar.update_layout(
-                    title=dict(
-                        text=f"特征:{max_feat}",
-                        font=dict(size=12),
-                        y=0.95
-                    ),
-                    xaxis_title=None,
-                    yaxis_title=None,
-                    showlegend=False,
-                    height=220, 
-                    margin=dict(l=10, r=10, t=30, b=10),
-                    yaxis=dict(
-                        showticklabels=False, 
-                        showgrid=False, 
-                        range=[0, max_val * 1.3]
-                    ),
-                    xaxis=dict(
-                        tickfont=dict(size=10)
-                    )
-                )
-                
-                st.plotly_chart(fig_bar, use_container_width=True, config={'displayModeBar': False})
\ No newline at end of file
+                ),
+                row=row, col=col
+            )
+            # 每个子图使用各自的纵轴范围，给柱顶数字留出空间
+            fig_bar.update_yaxes(range=[0, real_vals.max() * 1.3], row=row, col=col)
+
+        fig_bar.update_annotations(font=dict(size=12))
+        fig_bar.update_yaxes(showticklabels=False, showgrid=False, title=None)
+        fig_bar.update_xaxes(showticklabels=True, tickfont=dict(size=10), title=None)
+        fig_bar.update_layout(
+            showlegend=False,
+            height=260 * n_rows, 
+            margin=dict(l=10, r=10, t=50, b=10),
+        )
+        
+        st.plotly_chart(fig_bar, use_container_width=True, config={'displayModeBar': False})
\ No newline at end of file